@@ -1,21 +1,24 @@
 import os
-from typing import Optional, List, Dict, Any
-from datetime import datetime
-
-from fastapi import (
-    FastAPI,
-    Query,
-    Security,
-    HTTPException,
-    status,
-    Request,
-    Depends
-)
-from fastapi.security import APIKeyHeader
-from fastapi.responses import JSONResponse
+import hmac
+import asyncio
+import logging
+import re
+import time
+from typing import Optional, List, Dict, Any, Tuple, Union
+from datetime import datetime, timezone
+from urllib.parse import parse_qs
+
+import msgspec
+import orjson
+from bson import ObjectId
+
+from fastapi import FastAPI, Query, status, Request
+from fastapi.openapi.utils import get_openapi
+from fastapi.responses import Response
+from starlette.types import ASGIApp, Receive, Scope, Send
 
 from motor.motor_asyncio import AsyncIOMotorClient
-from pydantic import BaseModel
+from pymongo.errors import BulkWriteError
 
 # ---------- RATE LIMITING ----------
 from slowapi import Limiter
@@ -24,19 +27,45 @@ from slowapi.errors import RateLimitExceeded
 from slowapi.middleware import SlowAPIMiddleware
 
 
-limiter = Limiter(key_func=get_remote_address)
+logger = logging.getLogger(__name__)
+
+
+# ---------- RESPONSES ----------
+def _orjson_default(obj: Any) -> Any:
+    if isinstance(obj, ObjectId):
+        return str(obj)
+    raise TypeError
+
+
+class ORJSONResponse(Response):
+    media_type = "application/json"
+
+    def render(self, content: Any) -> bytes:
+        return orjson.dumps(content, default=_orjson_default)
+
 
-app = FastAPI(title="Log Analytics API")
+limiter = Limiter(key_func=get_remote_address, storage_uri="memory://")
+
+app = FastAPI(
+    title="Log Analytics API",
+    default_response_class=ORJSONResponse
+)
 app.state.limiter = limiter
 app.add_middleware(SlowAPIMiddleware)
 
 
 # 🔹 Custom error message for rate limit
+_RATE_LIMITED_BODY = orjson.dumps(
+    {"detail": "Rate limit exceeded. Try again later."}
+)
+
+
 @app.exception_handler(RateLimitExceeded)
 async def rate_limit_handler(request: Request, exc: RateLimitExceeded):
-    return JSONResponse(
+    return Response(
+        content=_RATE_LIMITED_BODY,
         status_code=429,
-        content={"detail": "Rate limit exceeded. Try again later."}
+        media_type="application/json"
     )
 
 
@@ -47,70 +76,360 @@ API_KEY = os.getenv("API_KEY")
 if not MONGO_URI:
     raise RuntimeError("MONGO_URI environment variable is not set")
 
+# Size the pool to concurrent requests * Mongo ops per request so bursts
+# don't queue on connection checkout
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "200"))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "20"))
+
 
 # ---------- API KEY SECURITY ----------
 API_KEY_NAME = "X-API-KEY"
+_API_KEY_BYTES = API_KEY.encode() if API_KEY else b""
+_API_KEY_HEADER = API_KEY_NAME.lower().encode()
 
-api_key_header = APIKeyHeader(
-    name=API_KEY_NAME,
-    auto_error=False
-)
+PROTECTED_PREFIXES = ("/logs", "/stats")
 
+_INVALID_KEY_BODY = orjson.dumps({"detail": "Invalid or missing API key"})
+_MISSING_KEY_BODY = orjson.dumps({"detail": "API_KEY not configured on server"})
 
-async def verify_api_key(
-    request: Request,
-    api_key: str = Security(api_key_header)
-) -> str:
-    if not API_KEY:
-        raise HTTPException(
-            status_code=500,
-            detail="API_KEY not configured on server"
-        )
 
-    # Try header first, then query parameter (for browser testing)
-    key = api_key or request.query_params.get("api_key")
-    
-    if key != API_KEY:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Invalid or missing API key"
-        )
+def _request_api_key(scope: Scope) -> Optional[bytes]:
+    for name, value in scope["headers"]:
+        if name == _API_KEY_HEADER:
+            return value
+
+    # Fall back to the query parameter (for browser testing)
+    if scope["query_string"]:
+        values = parse_qs(scope["query_string"]).get(b"api_key")
+        if values:
+            return values[0]
+
+    return None
+
+
+class APIKeyMiddleware:
+    """Rejects requests to protected routes before routing runs."""
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or not scope["path"].startswith(
+            PROTECTED_PREFIXES
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        if not _API_KEY_BYTES:
+            response = Response(
+                content=_MISSING_KEY_BODY,
+                status_code=500,
+                media_type="application/json"
+            )
+        else:
+            key = _request_api_key(scope)
+            if key and hmac.compare_digest(key, _API_KEY_BYTES):
+                await self.app(scope, receive, send)
+                return
+
+            response = Response(
+                content=_INVALID_KEY_BODY,
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                media_type="application/json"
+            )
+
+        await response(scope, receive, send)
+
 
-    return key
+# Added last so it wraps SlowAPIMiddleware: bad keys never touch the limiter
+app.add_middleware(APIKeyMiddleware)
+
+
+def api_openapi() -> Dict[str, Any]:
+    # Auth no longer runs through a Security dependency, so declare the
+    # X-API-KEY scheme by hand to keep it (and /docs "Authorize") in the schema
+    if app.openapi_schema:
+        return app.openapi_schema
+
+    schema = get_openapi(
+        title=app.title,
+        version=app.version,
+        openapi_version=app.openapi_version,
+        routes=app.routes
+    )
+    schema.setdefault("components", {})["securitySchemes"] = {
+        "APIKeyHeader": {"type": "apiKey", "in": "header", "name": API_KEY_NAME}
+    }
+
+    for path, operations in schema["paths"].items():
+        if path.startswith(PROTECTED_PREFIXES):
+            for operation in operations.values():
+                operation["security"] = [{"APIKeyHeader": []}]
+
+    app.openapi_schema = schema
+    return schema
+
+
+app.openapi = api_openapi
 
 
 # ---------- DATABASE ----------
-client = AsyncIOMotorClient(MONGO_URI)
+# Log text compresses well; zstd is preferred, zlib is the stdlib fallback
+# the server negotiates if zstd is unavailable on its side
+client = AsyncIOMotorClient(
+    MONGO_URI,
+    compressors="zstd,zlib",
+    zlibCompressionLevel=-1,
+    maxPoolSize=MONGO_MAX_POOL_SIZE,
+    minPoolSize=MONGO_MIN_POOL_SIZE,
+    waitQueueTimeoutMS=1000,
+    serverSelectionTimeoutMS=2000
+)
 db = client["logsdb"]
 collection = db["logs"]
+stats_collection = db["stats"]
+
+# Fields returned by GET /logs; anything else stored on a log stays in Mongo
+LOG_PROJECTION = {
+    "_id": 1,
+    "level": 1,
+    "service": 1,
+    "message": 1,
+    "timestamp": 1
+}
 
 
 @app.on_event("startup")
 async def ensure_indexes():
-    await collection.create_index("level")
-    await collection.create_index("service")
+    # Equality filters first, sort key last, so GET /logs filtered by
+    # level (+ service) walks the index in timestamp order
+    await collection.create_index(
+        [("level", 1), ("service", 1), ("timestamp", -1)]
+    )
+    # service isn't a prefix of the index above, so service-only filters
+    # need their own or they fall back to walking the timestamp index
+    await collection.create_index([("service", 1), ("timestamp", -1)])
     await collection.create_index("timestamp")
 
 
-# ---------- HELPERS ----------
-def serialize(doc: Dict[str, Any]) -> Dict[str, Any]:
-    doc["_id"] = str(doc["_id"])
-    return doc
+# ---------- PRE-AGGREGATED STATS ----------
+# One small document per field, e.g.
+# {"_id": "level", "items": [{"level": "ERROR", "count": 42}, ...]},
+# rebuilt from the logs collection every STATS_REFRESH_SECONDS so /stats/*
+# never scans logs on the request path. Rebuilding from the source rather
+# than counting inserts also picks up logs loaded outside the API
+# (mongoimport, a loader) and can't drift after a partial insert failure.
+STATS_FIELDS = ("level", "service")
+STATS_REFRESH_SECONDS = 30.0
+
+
+async def refresh_stats() -> None:
+    for field in STATS_FIELDS:
+        pipeline = [
+            {"$group": {"_id": f"${field}", "count": {"$sum": 1}}},
+            {"$sort": {"count": -1}},
+            {"$project": {"_id": 0, field: "$_id", "count": 1}}
+        ]
+        items = await collection.aggregate(pipeline).to_list(length=None)
+
+        await stats_collection.replace_one(
+            {"_id": field},
+            {"items": items, "refreshed_at": datetime.now(timezone.utc)},
+            upsert=True
+        )
+
+
+async def _refresh_stats_forever() -> None:
+    # First pass runs right away but off the startup path: the stats
+    # documents persist in Mongo, so a restart keeps serving the last ones
+    while True:
+        try:
+            await refresh_stats()
+        except Exception:
+            logger.exception("Failed to refresh stats")
+        await asyncio.sleep(STATS_REFRESH_SECONDS)
+
+
+@app.on_event("startup")
+async def start_stats_refresher():
+    app.state.stats_refresher = asyncio.create_task(_refresh_stats_forever())
+
+
+@app.on_event("shutdown")
+async def stop_stats_refresher():
+    app.state.stats_refresher.cancel()
+
+
+# ---------- WRITE COALESCING ----------
+# POST /logs enqueues documents; one background task flushes them with
+# insert_many once WRITE_BATCH_SIZE docs are queued or WRITE_FLUSH_SECONDS
+# have passed since the first doc of the batch arrived.
+WRITE_QUEUE_SIZE = 10000
+WRITE_BATCH_SIZE = 500
+WRITE_FLUSH_SECONDS = 0.05
+
+# A queued log is acknowledged with 202 before it is written, so anything
+# Mongo could refuse (16 MB document limit) is turned away up front
+MAX_LOG_BYTES = 1024 * 1024
+
+# POST /logs/bulk bodies; kept well under 16 MB so no single element can
+# exceed Mongo's document limit
+MAX_BULK_BYTES = 8 * 1024 * 1024
+
+# Put on the queue at shutdown so the flusher writes what it has and exits
+_STOP = object()
+
+
+async def _insert_batch(batch: List[Dict[str, Any]]) -> None:
+    try:
+        await collection.insert_many(batch, ordered=False)
+    except Exception:
+        # Never let one bad batch end the only flusher task
+        logger.exception("Failed to flush %d queued logs", len(batch))
+
+
+async def _flush_writes(queue: asyncio.Queue) -> None:
+    loop = asyncio.get_running_loop()
+
+    while True:
+        item = await queue.get()
+        if item is _STOP:
+            return
+
+        batch = [item]
+        deadline = loop.time() + WRITE_FLUSH_SECONDS
+        stop = False
+
+        while len(batch) < WRITE_BATCH_SIZE:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                item = await asyncio.wait_for(queue.get(), timeout)
+            except asyncio.TimeoutError:
+                break
+            if item is _STOP:
+                stop = True
+                break
+            batch.append(item)
+
+        await _insert_batch(batch)
+
+        if stop:
+            return
+
+
+@app.on_event("startup")
+async def start_write_flusher():
+    app.state.write_queue = asyncio.Queue(maxsize=WRITE_QUEUE_SIZE)
+    app.state.write_flusher = asyncio.create_task(
+        _flush_writes(app.state.write_queue)
+    )
+
+
+@app.on_event("shutdown")
+async def stop_write_flusher():
+    await app.state.write_queue.put(_STOP)
+    await app.state.write_flusher
+
+
+# ---------- STATS CACHE ----------
+# Stats documents per field, kept as already-encoded bodies
+STATS_CACHE_SECONDS = 5.0
+
+_stats_cache: Dict[str, Tuple[float, bytes]] = {}
+
+
+async def cached_stats(field: str) -> Response:
+    now = time.monotonic()
+    hit = _stats_cache.get(field)
+
+    if hit and now - hit[0] < STATS_CACHE_SECONDS:
+        return Response(content=hit[1], media_type="application/json")
+
+    doc = await stats_collection.find_one({"_id": field})
+    items = doc["items"] if doc else []
+
+    content = orjson.dumps({"items": items}, default=_orjson_default)
+    _stats_cache[field] = (now, content)
+
+    return Response(content=content, media_type="application/json")
 
 
 # ---------- SCHEMAS ----------
-class LogCreate(BaseModel):
+# msgspec reports no field path for errors raised in __post_init__, so
+# invalid_body maps their messages back to the field they belong to
+_TIMESTAMP_RANGE_ERROR = "Timestamp is out of range"
+_POST_INIT_ERROR_FIELDS = {_TIMESTAMP_RANGE_ERROR: "timestamp"}
+
+
+class LogCreate(msgspec.Struct):
     level: str
     service: str
     message: str
-    timestamp: Optional[datetime] = None
+    # Numbers are Unix epochs (seconds, or milliseconds past 2e10, the same
+    # rule pydantic used); __post_init__ turns them into datetimes
+    timestamp: Union[datetime, float, None] = None
+
+    def __post_init__(self) -> None:
+        if isinstance(self.timestamp, float):
+            seconds = self.timestamp
+            if abs(seconds) > 2e10:
+                seconds /= 1000
+            try:
+                self.timestamp = datetime.fromtimestamp(seconds, timezone.utc)
+            except (OverflowError, OSError, ValueError):
+                raise ValueError(_TIMESTAMP_RANGE_ERROR) from None
+
+
+# POST bodies are decoded straight from bytes instead of through FastAPI's
+# pydantic body parsing; strict=False keeps accepting numeric strings
+_log_decoder = msgspec.json.Decoder(LogCreate, strict=False)
+_bulk_decoder = msgspec.json.Decoder(List[LogCreate], strict=False)
+
+_ERROR_PATH = re.compile(r"\.(\w+)|\[(\d+)\]")
+
+
+def body_too_large(limit: int) -> Response:
+    return ORJSONResponse(
+        {"detail": f"Request body exceeds {limit} bytes"},
+        status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE
+    )
+
+
+def invalid_body(exc: msgspec.DecodeError) -> Response:
+    # Same {"detail": [{type, loc, msg}]} shape as FastAPI's own 422s
+    msg, _, path = str(exc).partition(" - at `")
+    loc: List[Any] = ["body"]
+    for key, index in _ERROR_PATH.findall(path):
+        loc.append(key or int(index))
+
+    msg = msg.strip()
+    if msg in _POST_INIT_ERROR_FIELDS:
+        loc.append(_POST_INIT_ERROR_FIELDS[msg])
+
+    if not isinstance(exc, msgspec.ValidationError):
+        error_type = "json_invalid"
+    elif msg.startswith("Object missing required field"):
+        error_type = "missing"
+        loc.append(msg.split("`")[1])
+    else:
+        error_type = "value_error"
+
+    return ORJSONResponse(
+        {"detail": [{"type": error_type, "loc": loc, "msg": msg}]},
+        status_code=status.HTTP_422_UNPROCESSABLE_ENTITY
+    )
 
 
 # ---------- ROUTES ----------
 
+_OK_BODY = orjson.dumps({"status": "ok"})
+
+
 @app.get("/")
 async def root():
-    return {"status": "ok"}
+    return Response(content=_OK_BODY, media_type="application/json")
 
 
 @app.get("/logs")
@@ -119,8 +438,7 @@ async def get_logs(
     request: Request,
     level: Optional[str] = Query(None),
     service: Optional[str] = Query(None),
-    limit: int = Query(50, ge=1, le=500),
-    _: str = Depends(verify_api_key)
+    limit: int = Query(50, ge=1, le=500)
 ):
     query: Dict[str, Any] = {}
 
@@ -129,60 +447,101 @@ async def get_logs(
     if service:
         query["service"] = service
 
-    cursor = collection.find(query).sort("timestamp", -1).limit(limit)
+    # $sort + $limit come straight after $match so the index serves them
+    # and any later stages ($project, future $lookup) only see `limit` docs
+    pipeline = [
+        {"$match": query},
+        {"$sort": {"timestamp": -1}},
+        {"$limit": limit},
+        {"$project": LOG_PROJECTION}
+    ]
 
-    items: List[Dict[str, Any]] = []
-    async for doc in cursor:
-        items.append(serialize(doc))
+    # First batch defaults to 101 docs; ask for all of them in one reply
+    cursor = collection.aggregate(
+        pipeline,
+        allowDiskUse=False,
+        batchSize=limit
+    )
+    items: List[Dict[str, Any]] = await cursor.to_list(length=limit)
 
-    return {"count": len(items), "items": items}
+    return ORJSONResponse({"count": len(items), "items": items})
 
 
 @app.post("/logs")
 @limiter.limit("10/minute")
-async def add_log(
-    request: Request,
-    log: LogCreate,
-    _: str = Depends(verify_api_key)
-):
-    doc = log.model_dump()
-
-    if not doc.get("timestamp"):
-        doc["timestamp"] = datetime.utcnow()
+async def add_log(request: Request):
+    body = await request.body()
+
+    if len(body) > MAX_LOG_BYTES:
+        return body_too_large(MAX_LOG_BYTES)
+
+    try:
+        log = _log_decoder.decode(body)
+    except msgspec.DecodeError as exc:
+        return invalid_body(exc)
+
+    if not log.timestamp:
+        log.timestamp = datetime.now(timezone.utc)
+
+    # asdict copies, so the _id insert_many adds never reaches the echo
+    await request.app.state.write_queue.put(msgspec.structs.asdict(log))
+    content = b'{"status":"queued","log":' + msgspec.json.encode(log) + b"}"
+    return Response(
+        content=content,
+        status_code=status.HTTP_202_ACCEPTED,
+        media_type="application/json"
+    )
 
-    await collection.insert_one(doc)
-    return {"status": "inserted", "log": doc}
 
+@app.post("/logs/bulk")
+@limiter.limit("10/minute")
+async def add_logs_bulk(request: Request):
+    body = await request.body()
+
+    if len(body) > MAX_BULK_BYTES:
+        return body_too_large(MAX_BULK_BYTES)
+
+    try:
+        logs = _bulk_decoder.decode(body)
+    except msgspec.DecodeError as exc:
+        return invalid_body(exc)
+
+    if not logs:
+        return ORJSONResponse({"status": "inserted", "count": 0})
+
+    now = datetime.now(timezone.utc)
+    docs = [msgspec.structs.asdict(log) for log in logs]
+
+    for doc in docs:
+        if not doc.get("timestamp"):
+            doc["timestamp"] = now
+
+    try:
+        result = await collection.insert_many(docs, ordered=False)
+    except BulkWriteError as exc:
+        # Unordered: everything not listed in writeErrors was stored
+        return ORJSONResponse(
+            {
+                "status": "partial",
+                "count": exc.details["nInserted"],
+                "failed": [
+                    {"index": err["index"], "detail": err["errmsg"]}
+                    for err in exc.details["writeErrors"]
+                ]
+            },
+            status_code=status.HTTP_207_MULTI_STATUS
+        )
 
-@app.get("/stats/levels")
-async def stats_levels(request: Request, _: str = Depends(verify_api_key)):
-    pipeline = [
-        {"$group": {"_id": "$level", "count": {"$sum": 1}}},
-        {"$sort": {"count": -1}}
-    ]
+    return ORJSONResponse(
+        {"status": "inserted", "count": len(result.inserted_ids)}
+    )
 
-    items: List[Dict[str, Any]] = []
-    async for row in collection.aggregate(pipeline):
-        items.append({
-            "level": row["_id"],
-            "count": row["count"]
-        })
 
-    return {"items": items}
+@app.get("/stats/levels")
+async def stats_levels():
+    return await cached_stats("level")
 
 
 @app.get("/stats/services")
-async def stats_services(request: Request, _: str = Depends(verify_api_key)):
-    pipeline = [
-        {"$group": {"_id": "$service", "count": {"$sum": 1}}},
-        {"$sort": {"count": -1}}
-    ]
-
-    items: List[Dict[str, Any]] = []
-    async for row in collection.aggregate(pipeline):
-        items.append({
-            "service": row["_id"],
-            "count": row["count"]
-        })
-
-    return {"items": items}
+async def stats_services():
+    return await cached_stats("service")